@@ -1,9 +1,16 @@
+import asyncio
+import bisect
+import hashlib
 import json
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
 from astrbot.api.provider import ProviderRequest
 from dataclasses import dataclass
-from datetime import datetime, time, timezone
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from astrbot.api.event import MessageChain
 from astrbot.api.event import filter, AstrMessageEvent, MessageEventResult
 from astrbot.api import logger
@@ -20,10 +27,42 @@ from astrbot.api import AstrBotConfig
 
 import os
 from astrbot.core.utils.astrbot_path import get_astrbot_data_path
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows 下没有 fcntl
+    fcntl = None
+
+
 def _utc_now() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+_CROCKFORD32 = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_ULID_LOCK = threading.Lock()
+_ulid_last = (0, 0)
+
+
+def _new_ulid() -> str:
+    """生成 ULID：48 位毫秒时间戳 + 80 位随机数。
+
+    同一毫秒内随机部分递增，因此同一进程内严格单调，字符串顺序即生成顺序。
+    """
+    global _ulid_last
+    with _ULID_LOCK:
+        ms = time.time_ns() // 1_000_000
+        last_ms, last_rand = _ulid_last
+        if ms <= last_ms:
+            ms, rand = last_ms, last_rand + 1
+            if rand >= 1 << 80:
+                ms, rand = ms + 1, int.from_bytes(os.urandom(10), "big")
+        else:
+            rand = int.from_bytes(os.urandom(10), "big")
+        _ulid_last = (ms, rand)
+    value = (ms << 80) | rand
+    return "".join(_CROCKFORD32[(value >> shift) & 31] for shift in range(125, -1, -5))
+
+
 def _default_state() -> Dict[str, Any]:
     now = _utc_now()
     return {
@@ -39,67 +78,613 @@ def _default_state() -> Dict[str, Any]:
     }
 
 
+_PATH_LOCKS: Dict[str, Any] = {}
+_PATH_LOCKS_GUARD = threading.Lock()
+# 当前线程已持有 fcntl 锁的路径，用于重入时跳过重复加锁
+_LOCK_STATE = threading.local()
+# 本进程通过 _try_file_lock 持有的锁文件
+_HELD_TRY_LOCKS: set = set()
+# 每个进程最多缓存的记忆文件数，按最近使用淘汰
+_STORE_CACHE_SIZE = 16
+_STORE_CACHE: "OrderedDict[str, _CachedStore]" = OrderedDict()
+_STORE_CACHE_LOCK = threading.Lock()
+
+
+@contextmanager
+def _file_lock(path):
+    """对 <path>.lock 加跨进程独占建议锁。
+
+    同一进程内先用按路径划分的 RLock 串行化各线程，因此可重入且线程安全；没有 fcntl 的平台上只有进程内互斥。
+    获取锁可能阻塞，异步代码中应通过 asyncio.to_thread 执行加锁的操作。
+    """
+    lock_path = str(path) + ".lock"
+    with _PATH_LOCKS_GUARD:
+        thread_lock = _PATH_LOCKS.setdefault(lock_path, threading.RLock())
+    held = _LOCK_STATE.__dict__.setdefault("held", set())
+    with thread_lock:
+        if fcntl is None or lock_path in held:
+            yield
+            return
+
+        Path(lock_path).parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            held.add(lock_path)
+            try:
+                yield
+            finally:
+                held.discard(lock_path)
+        finally:
+            os.close(fd)
+
+
+@contextmanager
+def _try_file_lock(path):
+    """非阻塞地对 <path>.lock 加跨进程独占建议锁，yield 是否获取成功。
+
+    用于跨越多个 await 的长任务：同一进程内也不可重入，已被任何协程、线程或进程持有时立即返回 False。
+    """
+    lock_path = str(path) + ".lock"
+    with _PATH_LOCKS_GUARD:
+        acquired = lock_path not in _HELD_TRY_LOCKS
+        _HELD_TRY_LOCKS.add(lock_path)
+    if not acquired:
+        yield False
+        return
+
+    fd = None
+    try:
+        if fcntl is not None:
+            Path(lock_path).parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                acquired = False
+        yield acquired
+    finally:
+        if fd is not None:
+            os.close(fd)
+        with _PATH_LOCKS_GUARD:
+            _HELD_TRY_LOCKS.discard(lock_path)
+
+
+def _version_path(path) -> Path:
+    return Path(str(path) + ".version")
+
+
+def _read_version(path) -> int:
+    """读取 path 的共享版本号，从未写入过时为 0。"""
+    try:
+        return int(_version_path(path).read_text(encoding="utf-8").strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def _atomic_write(path, text: str) -> None:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(text, encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def _write_versioned(path, text: str) -> int:
+    """原子替换文件内容并递增共享版本号，调用方需持有 path 的锁。"""
+    _atomic_write(path, text)
+    version = _read_version(path) + 1
+    _atomic_write(_version_path(path), str(version))
+    return version
+
+
+def _file_signature(path) -> Optional[Tuple]:
+    """文件及其版本号文件的元数据签名，签名不变说明没有进程写入过；文件不存在时返回 None。"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    try:
+        version_stat = os.stat(_version_path(path))
+        version_sig = (version_stat.st_ino, version_stat.st_mtime_ns)
+    except FileNotFoundError:
+        version_sig = None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size, version_sig)
+
+
+def _copy_state(state: Dict[str, Any]) -> Dict[str, Any]:
+    """复制顶层结构、各层级列表和其中的每条记忆，返回值可以直接修改而不影响缓存。"""
+    return {
+        key: [dict(entry) if isinstance(entry, dict) else entry for entry in value] if isinstance(value, list) else value
+        for key, value in state.items()
+    }
+
+
+def _cache_lookup(key: str, signature: Any) -> Optional["_CachedStore"]:
+    with _STORE_CACHE_LOCK:
+        cached = _STORE_CACHE.get(key)
+        if cached is None or cached.signature != signature:
+            return None
+        _STORE_CACHE.move_to_end(key)
+        return cached
+
+
+def _cache_store(key: str, cached: "_CachedStore") -> None:
+    with _STORE_CACHE_LOCK:
+        _STORE_CACHE[key] = cached
+        _STORE_CACHE.move_to_end(key)
+        while len(_STORE_CACHE) > _STORE_CACHE_SIZE:
+            _STORE_CACHE.popitem(last=False)
+
+
+@dataclass
+class _CachedStore:
+    signature: Any
+    state: Dict[str, Any]
+    # 按 updated_at 排序的 (时间戳列表, (tier, entry) 列表)，首次查询时构建
+    updated_index: Optional[Tuple[List[float], List[Tuple[str, Dict[str, Any]]]]] = None
+
+
 class MemoryStore:
+    """记忆文件读写。
+
+    多个进程共享同一数据目录时，写入在 fcntl 锁下原子替换文件并递增共享版本号；
+    读取时只比较文件签名，只有其他进程确实写入过才重新解析文件。
+    """
+
     def __init__(self, path: str):
         self.path = Path(path)
 
-    def load(self) -> Dict[str, Any]:
-        if not self.path.exists():
-            state = _default_state()
-            self.save(state)
-            return state
+    def lock(self):
+        """读-改-写期间持有的跨进程锁。"""
+        return _file_lock(self.path)
+
+    def _cached(self) -> _CachedStore:
+        key = str(self.path)
+        signature = _file_signature(self.path)
+        if signature is not None:
+            cached = _cache_lookup(key, signature)
+            if cached is not None:
+                return cached
+        else:
+            with self.lock():
+                if not self.path.exists():
+                    return self._write(_default_state())
+            signature = _file_signature(self.path)
         try:
-            return json.loads(self.path.read_text(encoding="utf-8"))
+            state = json.loads(self.path.read_text(encoding="utf-8"))
         except Exception as exc:  # pragma: no cover - 防止文件损坏导致崩溃
             logger.error("读取记忆文件失败，将使用默认结构: %s", exc)
-            state = _default_state()
-            self.save(state)
-            return state
+            return self._write(_default_state())
+        cached = _CachedStore(signature, state)
+        _cache_store(key, cached)
+        return cached
+
+    def _write(self, state: Dict[str, Any]) -> _CachedStore:
+        with self.lock():
+            _write_versioned(self.path, json.dumps(state, ensure_ascii=False, indent=2))
+            cached = _CachedStore(_file_signature(self.path), _copy_state(state))
+            _cache_store(str(self.path), cached)
+        return cached
+
+    def load(self) -> Dict[str, Any]:
+        return _copy_state(self._cached().state)
 
     def save(self, state: Dict[str, Any]) -> None:
-        self.path.parent.mkdir(parents=True, exist_ok=True)
-        self.path.write_text(
-            json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8"
-        )
+        self._write(state)
+
+    def changed_since(self, since: datetime) -> List[Tuple[str, Dict[str, Any]]]:
+        """返回 updated_at 晚于 since 的 (tier, entry)，按更新时间升序排列。
+
+        索引随缓存按文件版本构建一次，之后每次查询只需二分查找。
+        """
+        cached = self._cached()
+        if cached.updated_index is None:
+            rows = []
+            for tier in MEMORY_TIERS:
+                for entry in cached.state.get(tier, []):
+                    updated_at = _parse_timestamp(entry.get("updated_at") or "")
+                    if updated_at is not None:
+                        rows.append((updated_at.timestamp(), tier, entry))
+            rows.sort(key=lambda row: row[0])
+            cached.updated_index = ([row[0] for row in rows], [(tier, entry) for _, tier, entry in rows])
+        keys, entries = cached.updated_index
+        return [(tier, dict(entry)) for tier, entry in entries[bisect.bisect_right(keys, since.timestamp()):]]
+
+
+MEMORY_TIERS = ("core_memory", "long_term", "medium_term")
+
+
+def _diff_states(before: Dict[str, Any], after: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """按 memory_id 比较两个记忆状态，返回变更列表；entry 为 None 表示删除。"""
+    changes = []
+    for tier in MEMORY_TIERS:
+        old = {item.get("memory_id"): item for item in before.get(tier, []) if item.get("memory_id")}
+        new = {item.get("memory_id"): item for item in after.get(tier, []) if item.get("memory_id")}
+        for memory_id, entry in new.items():
+            if old.get(memory_id) != entry:
+                changes.append({"tier": tier, "memory_id": memory_id, "entry": entry})
+        for memory_id in old.keys() - new.keys():
+            changes.append({"tier": tier, "memory_id": memory_id, "entry": None})
+    return changes
+
+
+class MemoryHistory:
+    """记忆版本历史。
+
+    每次写入记录为一条带单调递增版本号的增量，每隔 checkpoint_interval 个版本保存一次完整检查点。
+    每个检查点之后的增量单独存放在一个 jsonl 文件中，恢复任意版本只需读取最近的检查点及其后的增量。
+    只保留最近 keep_checkpoints 个检查点及其增量，更早的版本会被清理。
+    """
+
+    def __init__(self, store_path: str, checkpoint_interval: int = 20, keep_checkpoints: int = 10):
+        store_path = Path(store_path)
+        self.root = store_path.parent / "memory_history" / store_path.stem
+        self.checkpoint_interval = max(1, checkpoint_interval)
+        self.keep_checkpoints = max(1, keep_checkpoints)
+
+    def _meta_path(self) -> Path:
+        return self.root / "meta.json"
+
+    def _checkpoint_path(self, version: int) -> Path:
+        return self.root / f"checkpoint_{version:08d}.json"
+
+    def _segment_path(self, checkpoint: int) -> Path:
+        return self.root / f"deltas_{checkpoint:08d}.jsonl"
+
+    def _load_meta(self) -> Dict[str, Any]:
+        if not self._meta_path().exists():
+            return {"version": 0, "checkpoints": []}
+        return json.loads(self._meta_path().read_text(encoding="utf-8"))
+
+    def _save_meta(self, meta: Dict[str, Any]) -> None:
+        _atomic_write(self._meta_path(), json.dumps(meta, ensure_ascii=False))
+
+    def _write_checkpoint(self, version: int, state: Dict[str, Any]) -> None:
+        _atomic_write(self._checkpoint_path(version), json.dumps(state, ensure_ascii=False))
+
+    def current_version(self) -> int:
+        return self._load_meta()["version"]
+
+    def oldest_version(self) -> int:
+        """仍可恢复的最早版本。"""
+        checkpoints = self._load_meta()["checkpoints"]
+        return checkpoints[0] if checkpoints else 0
+
+    def record(self, before: Dict[str, Any], after: Dict[str, Any]) -> Optional[int]:
+        """记录一次写入，返回新版本号；没有实际变更时返回 None。"""
+        changes = _diff_states(before, after)
+        if not changes:
+            return None
+        self.root.mkdir(parents=True, exist_ok=True)
+        meta = self._load_meta()
+        if not meta["checkpoints"]:
+            # 首次记录时以写入前的状态作为版本 0
+            self._write_checkpoint(0, before)
+            meta["checkpoints"] = [0]
+
+        version = meta["version"] + 1
+        delta = {"version": version, "created_at": _utc_now(), "changes": changes}
+        with self._segment_path(meta["checkpoints"][-1]).open("a", encoding="utf-8") as fp:
+            fp.write(json.dumps(delta, ensure_ascii=False) + "\n")
+        meta["version"] = version
+        if version - meta["checkpoints"][-1] >= self.checkpoint_interval:
+            self._write_checkpoint(version, after)
+            meta["checkpoints"].append(version)
+        expired = meta["checkpoints"][:-self.keep_checkpoints]
+        meta["checkpoints"] = meta["checkpoints"][-self.keep_checkpoints:]
+        self._save_meta(meta)
+        for checkpoint in expired:
+            self._checkpoint_path(checkpoint).unlink(missing_ok=True)
+            self._segment_path(checkpoint).unlink(missing_ok=True)
+        return version
+
+    def materialize(self, version: int) -> Dict[str, Any]:
+        """恢复指定版本的完整记忆状态。"""
+        meta = self._load_meta()
+        if not meta["checkpoints"]:
+            raise ValueError("尚未记录任何历史版本，记忆发生变更后才会产生版本。")
+        oldest = meta["checkpoints"][0]
+        if not oldest <= version <= meta["version"]:
+            raise ValueError(f"版本 {version} 不存在，当前可用版本为 {oldest}-{meta['version']}")
+        checkpoint = max(cp for cp in meta["checkpoints"] if cp <= version)
+        state = json.loads(self._checkpoint_path(checkpoint).read_text(encoding="utf-8"))
+        if version == checkpoint:
+            return state
+
+        # 每个层级只建一次索引，重放增量时直接修改索引
+        indexes = {
+            tier: {item.get("memory_id"): item for item in state.get(tier, []) if item.get("memory_id")}
+            for tier in MEMORY_TIERS
+        }
+        with self._segment_path(checkpoint).open(encoding="utf-8") as fp:
+            for line in fp:
+                delta = json.loads(line)
+                if delta["version"] > version:
+                    break
+                for change in delta["changes"]:
+                    if change["entry"] is None:
+                        indexes[change["tier"]].pop(change["memory_id"], None)
+                    else:
+                        indexes[change["tier"]][change["memory_id"]] = change["entry"]
+        for tier, index in indexes.items():
+            state[tier] = list(index.values())
+        return state
+
+
+class _JsonStreamReader:
+    """按块读取 JSON 文本的游标，缓冲区只保留尚未解析的部分。"""
+
+    def __init__(self, fp, chunk_size: int = 1 << 16):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+
+    def _fill(self) -> bool:
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """跳过空白并返回下一个字符，文件结束时返回空字符串。"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def take(self, expected: str) -> str:
+        ch = self.peek()
+        if not ch or ch not in expected:
+            raise ValueError(f"JSON 格式错误: 期望 {expected!r}，实际为 {ch!r}")
+        self.pos += 1
+        return ch
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # 数字可能被块边界截断，读到缓冲区末尾时先补充数据再确认
+            if end == len(self.buf) and self._fill():
+                continue
+            self.pos = end
+            return obj
+
+
+def _iter_store_entries(path) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """逐条读取记忆文件中的 (tier, entry)，内存占用只与单条记忆的大小有关。"""
+    with open(path, encoding="utf-8") as fp:
+        reader = _JsonStreamReader(fp)
+        reader.take("{")
+        if reader.peek() == "}":
+            return
+        while True:
+            key = reader.value()
+            reader.take(":")
+            if key in MEMORY_TIERS and reader.peek() == "[":
+                reader.take("[")
+                if reader.peek() == "]":
+                    reader.take("]")
+                else:
+                    while True:
+                        yield key, reader.value()
+                        if reader.take(",]") == "]":
+                            break
+            else:
+                reader.value()
+            if reader.take(",}") == "}":
+                return
+
+
+def _parse_timestamp(text: str) -> Optional[datetime]:
+    """解析 ISO 格式时间，未带时区时视为 UTC；无法解析时返回 None。"""
+    try:
+        parsed = datetime.fromisoformat(str(text).strip())
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def _as_text(value: Any) -> Optional[str]:
+    """将字符串或数字（如 QQ 号）转为去除首尾空白的字符串，其他类型返回 None。"""
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return None
+
 
 class UserRoster:
     def __init__(self: str):
         path = os.path.join(get_astrbot_data_path(), "user_roster.json")
         self.path = Path(path)
-        self.id_dict = self.load()
+        self._signature = None
+        self._id_dict: Dict[str, Any] = {}
+        self.refresh()
+
+    @property
+    def id_dict(self) -> Dict[str, Any]:
+        self.refresh()
+        return self._id_dict
+
+    def refresh(self) -> None:
+        """仅当其他进程写入过映射文件时重新加载。"""
+        signature = _file_signature(self.path)
+        if signature is not None and signature == self._signature:
+            return
+        self._id_dict = self.load()
+        self._signature = signature if signature is not None else _file_signature(self.path)
 
     def load(self) -> Dict[str, Any]:
+        """只读取不写入，id_dict 在事件循环中访问时不会等待文件锁；文件由 update 创建或覆盖。"""
         if not self.path.exists():
-            state = {}
-            self.save(state)
-            return state
+            return {}
         try:
             return json.loads(self.path.read_text(encoding="utf-8"))
         except Exception as exc:  # pragma: no cover - 防止文件损坏导致崩溃
-            logger.error("读取UserRoster文件失败，将使用默认结构: %s", exc)
-            state = {}
-            self.save(state)
-            return state
+            logger.error("读取UserRoster文件失败，将使用空映射，下次更新时覆盖: %s", exc)
+            return {}
     
     def save(self, state: Dict[str, Any]) -> None:
-        self.path.parent.mkdir(parents=True, exist_ok=True)
-        self.path.write_text(
-            json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8"
-        )
+        with _file_lock(self.path):
+            _write_versioned(self.path, json.dumps(state, ensure_ascii=False, indent=2))
 
     def update(self, k, v=None, delete=False):
-        if not delete:  
-            self.id_dict[k] = v
-            self.save(self.id_dict)
-        else:
-            if k in self.id_dict:
-                del self.id_dict[k]
-                self.save(self.id_dict)
-        logger.info(f"当前字典：{self.id_dict}")
+        with _file_lock(self.path):
+            # 先读取最新内容，避免覆盖其他进程的写入
+            id_dict = self.load()
+            if not delete:  
+                id_dict[k] = v
+                self.save(id_dict)
+            else:
+                if k in id_dict:
+                    del id_dict[k]
+                    self.save(id_dict)
+            self._id_dict = id_dict
+            self._signature = _file_signature(self.path)
+        logger.info(f"当前字典：{self._id_dict}")
 
     def check(self):
         return self.id_dict
 
+RenderKey = Tuple[str, Tuple[str, ...], bool]
+
+
+class AccessStats:
+    """记忆访问计数。
+
+    计数先在内存中累加，距上次写入超过 flush_interval 秒时才加锁合并到统计文件，
+    因此多个进程可以共享同一份统计而不必每次请求都写盘。
+    除 subject 和记忆外还按实际渲染的记忆块 (store_path, id_list, include_core) 计数，
+    访问最多的 hot_count 个记忆块保存在 hot_keys 中，每次 flush 时更新。
+    """
+
+    def __init__(self, path, flush_interval: int = 60, hot_count: int = 10):
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+        self.hot_count = hot_count
+        self.pending_subjects: Counter = Counter()
+        self.pending_memories: Counter = Counter()
+        self.pending_renders: Counter = Counter()
+        self.hot_keys: List[RenderKey] = []
+        self.last_flush = time.monotonic()
+
+    @staticmethod
+    def _encode_key(key: RenderKey) -> str:
+        store_path, id_list, include_core = key
+        return json.dumps([str(store_path), list(id_list), include_core], ensure_ascii=False)
+
+    @staticmethod
+    def _decode_key(text: str) -> RenderKey:
+        store_path, id_list, include_core = json.loads(text)
+        return store_path, tuple(id_list), include_core
+
+    def record(self, key: RenderKey, memory_ids: List[str]) -> None:
+        for subject_id in key[1]:
+            if subject_id and subject_id != "global":
+                self.pending_subjects[subject_id] += 1
+        self.pending_renders[self._encode_key(key)] += 1
+        self.pending_memories.update(memory_id for memory_id in memory_ids if memory_id)
+
+    def flush_due(self) -> bool:
+        return time.monotonic() - self.last_flush >= self.flush_interval
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        data = {"subjects": {}, "memories": {}, "renders": {}}
+        if self.path.exists():
+            try:
+                data.update(json.loads(self.path.read_text(encoding="utf-8")))
+            except Exception as exc:  # pragma: no cover - 统计文件损坏时重新计数
+                logger.error("读取访问统计失败，将重新计数: %s", exc)
+        return data
+
+    def take_pending(self) -> Dict[str, Counter]:
+        """取出尚未写入的计数并重新计时，需与 record 在同一线程（事件循环）中调用。"""
+        self.last_flush = time.monotonic()
+        pending = {"subjects": self.pending_subjects, "memories": self.pending_memories, "renders": self.pending_renders}
+        self.pending_subjects, self.pending_memories, self.pending_renders = Counter(), Counter(), Counter()
+        return pending
+
+    def flush(self, pending: Optional[Dict[str, Counter]] = None) -> None:
+        """合并 take_pending 取出的计数，并根据合并后的统计刷新 hot_keys。
+
+        在线程中执行时应先在事件循环中调用 take_pending，再把取出的计数传入，
+        以免写入时与 record 同时修改同一个 Counter。
+        """
+        if pending is None:
+            pending = self.take_pending()
+        if not any(pending.values()):
+            data = self.load()
+        else:
+            with _file_lock(self.path):
+                data = self.load()
+                for key, counter in pending.items():
+                    for name, count in counter.items():
+                        data[key][name] = data[key].get(name, 0) + count
+                _write_versioned(self.path, json.dumps(data, ensure_ascii=False))
+        self.hot_keys = [self._decode_key(text) for text, _ in Counter(data["renders"]).most_common(self.hot_count)]
+
+    def top_subjects(self, n: int) -> List[Tuple[str, int]]:
+        """返回访问最多的 n 个 subject 及其计数，包含尚未写入的计数。"""
+        return (Counter(self.load()["subjects"]) + self.pending_subjects).most_common(n)
+
+    def top_memories(self, n: int) -> List[Tuple[str, int]]:
+        return (Counter(self.load()["memories"]) + self.pending_memories).most_common(n)
+
+
+class RenderCache:
+    """渲染好的记忆块的 LRU 缓存。
+
+    缓存项记录生成时记忆文件的签名，文件变化后自动失效，并在下次 get 未命中后重新渲染；
+    被固定的热门项不参与淘汰。
+    """
+
+    def __init__(self, capacity: int = 128):
+        self.capacity = max(1, capacity)
+        self.entries: "OrderedDict[Tuple, Tuple[Any, Tuple[str, List[str]]]]" = OrderedDict()
+        self.pinned: set = set()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple, signature: Any, count: bool = True) -> Optional[Tuple[str, List[str]]]:
+        """读取缓存；count=False 时不计入命中率（用于预取）。"""
+        cached = self.entries.get(key)
+        if cached is None or cached[0] != signature:
+            if count:
+                self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        if count:
+            self.hits += 1
+        return cached[1]
+
+    def put(self, key: Tuple, signature: Any, value: Tuple[str, List[str]]) -> None:
+        self.entries[key] = (signature, value)
+        self.entries.move_to_end(key)
+        for old_key in list(self.entries):
+            if len(self.entries) - len(self.pinned & self.entries.keys()) <= self.capacity:
+                break
+            if old_key not in self.pinned and old_key != key:
+                del self.entries[old_key]
+
+    def pin(self, keys) -> None:
+        self.pinned = set(keys)
+
+
 @dataclass
 class UpsertResult:
     added: int = 0
@@ -116,9 +701,77 @@ class SimpleMemoryPlugin(Star):
         self.use_global = self.config.get("use_global", True)
         self.last_update: Dict[str, str] = {}
         self.user_roster = UserRoster()
-    # async def initialize(self):
-    #     """插件初始化时确保记忆文件存在。"""
-    #     _ = self.store.load()
+        self.access_stats = AccessStats(
+            os.path.join(get_astrbot_data_path(), "memory_access_stats.json"),
+            int(self.config.get("access_flush_interval", 60)),
+            int(self.config.get("hot_subject_count", 10)),
+        )
+        self.render_cache = RenderCache(int(self.config.get("render_cache_size", 128)))
+
+    async def initialize(self):
+        """插件初始化时预先渲染并固定访问最多的记忆块。"""
+        await asyncio.to_thread(self.access_stats.flush, self.access_stats.take_pending())
+        await self._prefetch_hot_set()
+
+    async def _prefetch_hot_set(self) -> None:
+        """固定 access_stats.hot_keys 中的记忆块，并渲染尚未缓存的项。"""
+        hot_keys = self.access_stats.hot_keys
+        self.render_cache.pin(hot_keys)
+        for store_path, id_list, include_core in hot_keys:
+            if os.path.exists(store_path):
+                await self._render_memories(store_path, list(id_list), include_core, count=False)
+
+    async def _record_access(self, key: RenderKey, memory_ids: List[str]) -> None:
+        """记录一次记忆块访问，到期时在线程中写入统计并更新固定的热门记忆块。"""
+        self.access_stats.record(key, memory_ids)
+        if self.access_stats.flush_due():
+            await asyncio.to_thread(self.access_stats.flush, self.access_stats.take_pending())
+            await self._prefetch_hot_set()
+
+    async def _render_memories(self, store_path: str, id_list: List[str], include_core: bool = True, count: bool = True) -> Tuple[str, List[str]]:
+        """渲染 id_list 相关的记忆块，返回 (文本, 涉及的 memory_id)，结果按文件签名缓存。
+
+        include_core 为 False 时核心记忆不按 subject 过滤，而是整体渲染为开头的 <core_memory> 块（用于注入提示词）。
+        """
+        key = (store_path, tuple(id_list), include_core)
+        cached = self.render_cache.get(key, _file_signature(store_path), count=count)
+        if cached is not None:
+            return cached
+
+        # 未命中时读取记忆文件可能需要加锁创建或重置文件，放到线程中执行；缓存本身只在事件循环中读写
+        signature, value = await asyncio.to_thread(self._render_block, store_path, id_list, include_core)
+        if signature is not None:
+            self.render_cache.put(key, signature, value)
+        return value
+
+    def _render_block(self, store_path: str, id_list: List[str], include_core: bool) -> Tuple[Any, Tuple[str, List[str]]]:
+        """直接读取缓存的记忆状态渲染记忆块（只读，不复制条目），返回 (所用状态的文件签名, (文本, memory_id))。"""
+        cached = MemoryStore(store_path)._cached()
+        state = cached.state
+        view = {tier: entries for tier, entries in state.items() if include_core or tier != "core_memory"}
+        text = self.process_mem_info(view, id_list=id_list)
+        memory_ids = [
+            entry.get("memory_id")
+            for tier in MEMORY_TIERS
+            for entry in view.get(tier, [])
+            if entry.get("subject_id") in id_list
+        ]
+        if not include_core:
+            core_mem = state.get("core_memory", [])
+            core_mem_info = "\n".join(
+                f"- memory_id:{entry.get('memory_id')}, {entry.get('content')}, subject_id: {entry.get('subject_id')})"
+                for entry in core_mem
+                if entry.get("content")
+            )
+            text = f"<core_memory>\n{core_mem_info}\n</core_memory>\n{text}"
+            memory_ids = [entry.get("memory_id") for entry in core_mem] + memory_ids
+        return cached.signature, (text, memory_ids)
+
+    def _mem_file_path(self, uid: str) -> str:
+        """返回 uid 对应的记忆文件路径，启用全局记忆时所有会话共用同一文件。"""
+        if self.use_global:
+            return os.path.join(get_astrbot_data_path(), "memory_store_global.json")
+        return os.path.join(get_astrbot_data_path(), f"memory_store_{uid}.json")
 
     def process_mem_info(self, mem_snapshot: Dict[str, Any], id_list=["global"]) -> str:
         """将记忆快照转换为字符串格式，供提示词使用。"""
@@ -155,23 +808,15 @@ class SimpleMemoryPlugin(Star):
         else:
             id_list = ["global", subject_id]  
             if sender_name not in self.user_roster.id_dict and msg_type != "GroupMessage":
-                self.user_roster.update(sender_name, subject_id)
+                await asyncio.to_thread(self.user_roster.update, sender_name, subject_id)
 
-        mem_file_path = os.path.join(get_astrbot_data_path(), "memory_store_global.json") if self.use_global else os.path.join(get_astrbot_data_path(), f"memory_store_{uid}.json")
+        mem_file_path = self._mem_file_path(uid)
         logger.info(f"当前路径: {mem_file_path}")
-        state = MemoryStore(mem_file_path).load()
-        core_mem = state.get("core_memory", [])
-        # logger.info(f"原始记忆快照_core_memory:{core_mem}")
-        core_mem_list = []
-        for entry in core_mem:
-            if entry.get("content"):
-                core_mem_list.append(f"- memory_id:{entry.get('memory_id')}, {entry.get('content')}, subject_id: {entry.get('subject_id')})")
-        core_mem_info = "\n".join(core_mem_list)
-        state.pop("core_memory", None)
         # memory_snapshot = json.dumps(state, ensure_ascii=False, indent=2)
 
-        # core_mem = self.process_mem_info(core_mem, id_list=id_list)
-        memory_snapshot = self.process_mem_info(state, id_list=id_list)
+        # 核心记忆块与 subject 记忆块一起缓存，命中时不需要读取记忆文件
+        memory_snapshot, memory_ids = await self._render_memories(mem_file_path, id_list, include_core=False)
+        await self._record_access((mem_file_path, tuple(id_list), False), memory_ids)
         ori_system_prompt = req.system_prompt or ""
         # logger.info(f"原系统提示词_SimpleMemory:{ori_system_prompt}")
 
@@ -195,7 +840,6 @@ class SimpleMemoryPlugin(Star):
             "5. 阅读和使用 core_memory 时，只能把它当作 AI 的人格底色与内在原则；如果内容是具体事实，应优先从 long_term 或 medium_term 理解。\n\n"
             
             "### [RETRIEVED MEMORIES] ###\n"
-            f"<core_memory>\n{core_mem_info}\n</core_memory>\n"
             f"{memory_snapshot}\n"
             "====================\n"
         )
@@ -210,17 +854,34 @@ class SimpleMemoryPlugin(Star):
         pass
     
     @mem.command("check")
-    async def check(self, event: AstrMessageEvent):
+    async def check(self, event: AstrMessageEvent, since: str = ""):
         '''
-        查看上次记忆更新内容
+        查看上次记忆更新内容，附加时间参数时列出该时间之后变化过的记忆
+        (e.g. /mem check 2026-01-01T08:00)
         '''
         uid = event.unified_msg_origin
-        if self.last_update.get(uid) is None:
+        if str(since).strip():
+            await self.context.send_message(uid, MessageChain().message(await asyncio.to_thread(self._format_changed_since, uid, str(since).strip())))
+        elif self.last_update.get(uid) is None:
             await self.context.send_message(uid,MessageChain().message("尚未进行过记忆更新。"))
         else:
             await self.context.send_message(uid,MessageChain().message(f"上次更新内容:\n{self.last_update[uid]}"))
         event.stop_event()
 
+    def _format_changed_since(self, uid: str, since_text: str, limit: int = 50) -> str:
+        since = _parse_timestamp(since_text)
+        if since is None:
+            return f"无法解析时间: {since_text}，请使用 ISO 格式，例如 2026-01-01 或 2026-01-01T08:00"
+        changed = MemoryStore(self._mem_file_path(uid)).changed_since(since)
+        if not changed:
+            return f"{since.isoformat()} 之后没有记忆变化。"
+        lines = [f"{since.isoformat()} 之后变化的记忆共 {len(changed)} 条:"]
+        for tier, entry in changed[-limit:]:
+            lines.append(f"- [{tier}] {entry.get('memory_id')} ({entry.get('updated_at')}): {entry.get('content')}")
+        if len(changed) > limit:
+            lines.append(f"... 仅显示最近的 {limit} 条")
+        return "\n".join(lines)
+
     @mem.command("gen")
     async def gen(self, event: AstrMessageEvent, extra_prompt: str="", use_full: str = ""):
         """生成记忆提示词或应用模型返回的记忆更新。
@@ -232,12 +893,161 @@ class SimpleMemoryPlugin(Star):
         mem_result = await self.send_prompt(event, extra_prompt=extra_prompt, full=(str(use_full).strip() == "--full"))
         self.last_update[event.unified_msg_origin] = mem_result
         
-        handle_result = self._handle_apply(event, mem_result)
+        handle_result = await self._handle_apply(event, mem_result)
         logger.info(f"应用记忆结果:{handle_result}")
         message_chain = MessageChain().message(handle_result)
         await self.context.send_message(event.unified_msg_origin,message_chain)
         event.stop_event()
     
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @mem.command("gen-all")
+    async def gen_all(self, event: AstrMessageEvent, option: str = ""):
+        """批量刷新所有会话的记忆（管理员）。
+        中途失败或中断后再次执行会跳过已完成的会话，附加 --restart 参数可清空进度重新开始。
+        (e.g. /mem gen-all --restart)
+        """
+        uid = event.unified_msg_origin
+        progress_path = Path(get_astrbot_data_path()) / "memory_gen_all_progress.json"
+        # 整个批量刷新期间持有进度文件的锁，其他管理员或进程同时执行时直接拒绝
+        with _try_file_lock(progress_path) as acquired:
+            if not acquired:
+                await self.context.send_message(uid, MessageChain().message("已有批量刷新正在进行，请等待其完成后再试。"))
+                event.stop_event()
+                return
+            await self._run_gen_all(event, progress_path, option)
+
+    async def _run_gen_all(self, event: AstrMessageEvent, progress_path: Path, option: str) -> None:
+        uid = event.unified_msg_origin
+        if str(option).strip() == "--restart" and progress_path.exists():
+            progress_path.unlink()
+        progress = self._load_gen_all_progress(progress_path)
+
+        sessions = await self._list_memory_sessions()
+        pending = [sid for sid in sessions if sid not in progress["done"]]
+        if not pending:
+            await self.context.send_message(uid, MessageChain().message("没有需要刷新的会话。"))
+            event.stop_event()
+            return
+
+        concurrency = max(1, int(self.config.get("gen_all_concurrency", 4)))
+        if self.use_global:
+            # 全局记忆下所有会话读写同一文件，并发时各会话基于同一份旧快照生成更新，会互相覆盖
+            concurrency = 1
+        max_retries = max(0, int(self.config.get("gen_all_max_retries", 3)))
+        base_delay = float(self.config.get("gen_all_retry_base_delay", 2.0))
+        await self.context.send_message(
+            uid,
+            MessageChain().message(
+                f"开始批量刷新记忆: 待处理 {len(pending)} 个会话，已完成 {len(progress['done'])} 个，并发上限 {concurrency}。"
+            ),
+        )
+
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies: List[float] = []
+        failures: Dict[str, str] = {}
+
+        async def refresh(session_id: str) -> None:
+            async with semaphore:
+                started = time.monotonic()
+                for attempt in range(max_retries + 1):
+                    try:
+                        mem_result = await self._send_prompt_for_uid(session_id)
+                        if not mem_result:
+                            raise ValueError("模型返回内容为空")
+                        handle_result = await asyncio.to_thread(self._apply_for_uid, session_id, mem_result)
+                        if not handle_result.startswith("记忆已更新"):
+                            # 模型输出无法解析或应用时同样视为失败并重试
+                            raise ValueError(handle_result)
+                        break
+                    except Exception as exc:
+                        if attempt >= max_retries:
+                            logger.error("刷新记忆失败 %s: %s", session_id, exc)
+                            failures[session_id] = str(exc)
+                            progress["failed"][session_id] = str(exc)
+                            self._save_gen_all_progress(progress_path, progress)
+                            return
+                        delay = base_delay * (2 ** attempt)
+                        logger.warning("刷新记忆出错 %s，%.1f 秒后重试(%d/%d): %s", session_id, delay, attempt + 1, max_retries, exc)
+                        await asyncio.sleep(delay)
+
+                self.last_update[session_id] = mem_result
+                logger.info(f"批量应用记忆结果 {session_id}:{handle_result}")
+                latencies.append(time.monotonic() - started)
+                progress["done"].append(session_id)
+                progress["failed"].pop(session_id, None)
+                self._save_gen_all_progress(progress_path, progress)
+
+        batch_started = time.monotonic()
+        results = await asyncio.gather(*(refresh(session_id) for session_id in pending), return_exceptions=True)
+        for session_id, result in zip(pending, results):
+            if isinstance(result, BaseException):
+                logger.error("刷新记忆异常 %s: %s", session_id, result)
+                failures[session_id] = str(result)
+        elapsed = time.monotonic() - batch_started
+
+        if not failures:
+            progress_path.unlink(missing_ok=True)
+        await self.context.send_message(uid, MessageChain().message(self._format_gen_all_summary(len(pending), latencies, failures, elapsed)))
+        event.stop_event()
+
+    async def _list_memory_sessions(self) -> List[str]:
+        """枚举拥有记忆文件或对话记录的会话。"""
+        sessions = set()
+        if not self.use_global:
+            for path in Path(get_astrbot_data_path()).glob("memory_store_*.json"):
+                session_id = path.stem[len("memory_store_"):]
+                if session_id != "global" and not session_id.endswith("_pre"):
+                    sessions.add(session_id)
+        try:
+            conversations = await self.context.conversation_manager.get_conversations()
+        except Exception as exc:
+            logger.warning("获取会话列表失败: %s", exc)
+            conversations = []
+        for conversation in conversations:
+            session_id = getattr(conversation, "user_id", None)
+            if session_id:
+                sessions.add(session_id)
+        return sorted(sessions)
+
+    def _gen_all_fingerprint(self) -> str:
+        """当前 mem_prompt 的指纹，提示词变化后旧的进度不再适用。"""
+        return hashlib.sha256(str(self.config.get("mem_prompt", "")).encode("utf-8")).hexdigest()
+
+    def _load_gen_all_progress(self, path: Path) -> Dict[str, Any]:
+        fingerprint = self._gen_all_fingerprint()
+        progress = {"started_at": _utc_now(), "fingerprint": fingerprint, "done": [], "failed": {}}
+        if path.exists():
+            try:
+                saved = json.loads(path.read_text(encoding="utf-8"))
+            except Exception as exc:  # pragma: no cover - 进度文件损坏时重新开始
+                logger.error("读取批量刷新进度失败，将重新开始: %s", exc)
+            else:
+                if saved.get("fingerprint") == fingerprint:
+                    progress.update(saved)
+                else:
+                    logger.info("mem_prompt 已变化，丢弃上次的批量刷新进度")
+        return progress
+
+    def _save_gen_all_progress(self, path: Path, progress: Dict[str, Any]) -> None:
+        _atomic_write(path, json.dumps(progress, ensure_ascii=False, indent=2))
+
+    def _format_gen_all_summary(self, total: int, latencies: List[float], failures: Dict[str, str], elapsed: float) -> str:
+        lines = [
+            f"批量刷新完成: 成功 {len(latencies)}/{total}，失败 {len(failures)}，总耗时 {elapsed:.1f} 秒",
+            f"- 吞吐: {len(latencies) / elapsed * 60 if elapsed > 0 else 0:.1f} 会话/分钟",
+        ]
+        if latencies:
+            ordered = sorted(latencies)
+            p50 = ordered[len(ordered) // 2]
+            p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+            lines.append(
+                f"- 单会话延迟: 平均 {sum(ordered) / len(ordered):.1f}s，p50 {p50:.1f}s，p95 {p95:.1f}s，最大 {ordered[-1]:.1f}s"
+            )
+        if failures:
+            lines.append("失败会话（再次执行 /mem gen-all 可继续处理）:")
+            lines.extend(f"- {session_id}: {reason}" for session_id, reason in failures.items())
+        return "\n".join(lines)
+
     @mem.command("help")
     async def help(self, event: AstrMessageEvent):
         yield event.plain_result(self._usage_manual())
@@ -246,27 +1056,202 @@ class SimpleMemoryPlugin(Star):
     @mem.command("rebuild")
     async def mem_rebuild(self, event):
         '''
-        重构记忆，将当前记忆备份为pre文件，然后根据备份重构记忆
-        适用于需要重构记忆的场景
+        重构记忆，根据当前记忆重新生成一份记忆并整体替换，替换前的记忆保留为一个历史版本
+        适用于需要重构记忆的场景，生成或解析失败时当前记忆保持不变
         '''
         uid = event.unified_msg_origin
-        mem_path = os.path.join(get_astrbot_data_path(), f"memory_store_{uid}.json") if not self.use_global else os.path.join(get_astrbot_data_path(), "memory_store_global.json")
-        pre_mem_path = os.path.join(get_astrbot_data_path(), f"memory_store_{uid}_pre.json") if not self.use_global else os.path.join(get_astrbot_data_path(), "memory_store_global_pre.json")
-        if os.path.exists(pre_mem_path):
-            state_pre = MemoryStore(pre_mem_path).load()
+        state_pre = await asyncio.to_thread(MemoryStore(self._mem_file_path(uid)).load)
+        try:
+            # 以空记忆生成提示词，旧记忆只作为重构参考；模型输出成功应用前不改动记忆文件
+            mem_result = await self._send_prompt_for_uid(
+                uid,
+                extra_prompt=f"这是你之前的记忆，根据这些记忆重构现在的记忆:{state_pre}",
+                state=_default_state(),
+            )
+        except Exception as exc:
+            logger.error("重构记忆失败 %s: %s", uid, exc)
+            await self.context.send_message(uid, MessageChain().message(f"重构失败，记忆未改动: {exc}"))
+            event.stop_event()
+            return
+        self.last_update[uid] = mem_result
+
+        handle_result = await asyncio.to_thread(self._apply_for_uid, uid, mem_result, True)
+        logger.info(f"重构记忆结果:{handle_result}")
+        if not handle_result.startswith("记忆已更新"):
+            handle_result = f"重构失败，记忆未改动: {handle_result}"
+        await self.context.send_message(uid, MessageChain().message(handle_result))
+        event.stop_event()
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @mem.command("rollback")
+    async def rollback(self, event: AstrMessageEvent, version: int):
+        '''
+        将记忆回滚到指定版本（管理员），回滚本身也会记录为一个新版本
+        (e.g. /mem rollback 12)
+        '''
+        uid = event.unified_msg_origin
+        store = MemoryStore(self._mem_file_path(uid))
+        history = self._history(store.path)
+
+        def restore() -> Optional[int]:
+            with store.lock():
+                restored = history.materialize(int(version))
+                before = store.load()
+                store.save(restored)
+                return history.record(before, restored)
+
+        try:
+            new_version = await asyncio.to_thread(restore)
+        except ValueError as exc:
+            await self.context.send_message(uid, MessageChain().message(str(exc)))
+            event.stop_event()
+            return
+        if new_version is None:
+            message = f"当前记忆与版本 {version} 相同，无需回滚。"
         else:
-            state_pre = MemoryStore(mem_path).load()
+            message = f"已回滚到版本 {version}，当前版本为 {new_version}。"
+        await self.context.send_message(uid, MessageChain().message(message))
+        event.stop_event()
+
+    @mem.command("diff")
+    async def diff(self, event: AstrMessageEvent, from_version: str = "", to_version: str = ""):
+        '''
+        比较两个版本的记忆差异，默认比较上一版本与当前版本
+        (e.g. /mem diff 3 5)
+        '''
+        uid = event.unified_msg_origin
+        store = MemoryStore(self._mem_file_path(uid))
+        history = self._history(store.path)
+
+        def load_versions() -> Tuple[int, int, Dict[str, Any], Dict[str, Any]]:
+            with store.lock():
+                end = int(to_version) if str(to_version).strip() else history.current_version()
+                start = int(from_version) if str(from_version).strip() else max(history.oldest_version(), end - 1)
+                return start, end, history.materialize(start), history.materialize(end)
+
         try:
-            os.rename(mem_path, pre_mem_path)
-            os.remove(mem_path)
-        except Exception as e:
-            logger.info(f"发生错误:{e}")
+            start, end, old_state, new_state = await asyncio.to_thread(load_versions)
+        except ValueError as exc:
+            await self.context.send_message(uid, MessageChain().message(str(exc)))
+            event.stop_event()
+            return
+        await self.context.send_message(uid, MessageChain().message(self._format_diff(start, end, old_state, new_state)))
+        event.stop_event()
 
-        # pre_mem = MemoryStore(pre_mem_path)
-        # state = pre_mem.load()
-        await self.gen(event, extra_prompt=f"这是你之前的记忆，根据这些记忆重构现在的记忆:{state_pre}")
+    @mem.command("export")
+    async def export(self, event: AstrMessageEvent):
+        '''
+        将记忆流式导出为 JSONL 文件，可按层级、subject_id、更新时间过滤
+        (e.g. /mem export tier=long_term,medium_term subject=123456 since=2026-01-01)
+        '''
+        uid = event.unified_msg_origin
+        options = self._parse_options(event.message_str or "")
+        out_path = os.path.join(get_astrbot_data_path(), f"memory_export_{datetime.now().strftime('%Y%m%d%H%M%S')}.jsonl")
+        try:
+            count = await asyncio.to_thread(
+                export_memories_jsonl,
+                self._mem_file_path(uid),
+                out_path,
+                tiers=options["tier"].split(",") if options.get("tier") else None,
+                subject_ids=options["subject"].split(",") if options.get("subject") else None,
+                updated_since=options.get("since"),
+            )
+            message = f"已导出 {count} 条记忆到 {out_path}"
+        except (OSError, ValueError) as exc:
+            message = f"导出失败: {exc}"
+        await self.context.send_message(uid, MessageChain().message(message))
         event.stop_event()
-    
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @mem.command("import")
+    async def import_(self, event: AstrMessageEvent, file_path: str):
+        '''
+        从 JSONL 文件导入记忆（管理员），文件必须位于 AstrBot 数据目录内，相对路径以数据目录为基准
+        (e.g. /mem import memory_export_20260101000000.jsonl)
+        '''
+        uid = event.unified_msg_origin
+        data_dir = Path(get_astrbot_data_path()).resolve()
+        in_path = (data_dir / file_path).resolve()
+        if not in_path.is_relative_to(data_dir):
+            await self.context.send_message(uid, MessageChain().message("只能导入 AstrBot 数据目录内的文件。"))
+            event.stop_event()
+            return
+        try:
+            message = await asyncio.to_thread(
+                import_memories_jsonl,
+                self._mem_file_path(uid),
+                in_path,
+                batch_size=int(self.config.get("import_batch_size", 200)),
+                checkpoint_interval=int(self.config.get("snapshot_checkpoint_interval", 20)),
+                keep_checkpoints=int(self.config.get("snapshot_keep_checkpoints", 10)),
+            )
+        except (OSError, ValueError) as exc:
+            # ValueError 包括文件不是 UTF-8 编码时的 UnicodeDecodeError
+            message = f"导入失败: {exc}"
+        await self.context.send_message(uid, MessageChain().message(message))
+        event.stop_event()
+
+    def _parse_options(self, message: str) -> Dict[str, str]:
+        """从命令文本中提取 key=value 形式的参数。"""
+        options = {}
+        for token in message.split():
+            key, sep, value = token.partition("=")
+            if sep and value:
+                options[key.lower()] = value
+        return options
+
+    @mem.command("stats")
+    async def stats(self, event: AstrMessageEvent, top_n: int = 10):
+        '''
+        查看访问最多的 subject 与记忆，以及记忆块缓存情况
+        (e.g. /mem stats 20)
+        '''
+        uid = event.unified_msg_origin
+        names: Dict[str, List[str]] = {}
+        for user_name, subject_id in self.user_roster.id_dict.items():
+            names.setdefault(subject_id, []).append(user_name)
+        lines = [f"访问最多的 {top_n} 个 subject:"]
+        for subject_id, count in self.access_stats.top_subjects(int(top_n)):
+            alias = f" ({', '.join(names[subject_id])})" if subject_id in names else ""
+            lines.append(f"- {subject_id}{alias}: {count} 次")
+        lines.append(f"访问最多的 {top_n} 条记忆:")
+        lines.extend(f"- {memory_id}: {count} 次" for memory_id, count in self.access_stats.top_memories(int(top_n)))
+        cache = self.render_cache
+        total = cache.hits + cache.misses
+        lines.append(
+            f"记忆块缓存: {len(cache.entries)} 项，固定 {len(cache.pinned)} 项，"
+            f"命中率 {cache.hits / total * 100 if total else 0:.1f}% ({cache.hits}/{total})"
+        )
+        await self.context.send_message(uid, MessageChain().message("\n".join(lines)))
+        event.stop_event()
+
+    def _history(self, store_path) -> MemoryHistory:
+        return MemoryHistory(
+            store_path,
+            int(self.config.get("snapshot_checkpoint_interval", 20)),
+            int(self.config.get("snapshot_keep_checkpoints", 10)),
+        )
+
+    def _format_diff(self, start: int, end: int, old_state: Dict[str, Any], new_state: Dict[str, Any], limit: int = 50) -> str:
+        changes = _diff_states(old_state, new_state)
+        if not changes:
+            return f"版本 {start} 与版本 {end} 之间没有差异。"
+        old_index = {
+            (tier, item.get("memory_id")): item for tier in MEMORY_TIERS for item in old_state.get(tier, [])
+        }
+        lines = [f"版本 {start} -> {end}，共 {len(changes)} 处变更:"]
+        for change in changes[:limit]:
+            key = (change["tier"], change["memory_id"])
+            if change["entry"] is None:
+                lines.append(f"- [{change['tier']}] {change['memory_id']}: {old_index[key].get('content')}")
+            elif key in old_index:
+                lines.append(f"~ [{change['tier']}] {change['memory_id']}: {change['entry'].get('content')}")
+            else:
+                lines.append(f"+ [{change['tier']}] {change['memory_id']}: {change['entry'].get('content')}")
+        if len(changes) > limit:
+            lines.append(f"... 其余 {len(changes) - limit} 处变更未显示")
+        return "\n".join(lines)
+
     @filter.llm_tool(name="update_user_roster_id_dict") 
     async def update_user_roster_id_dict(self, event: AstrMessageEvent, 
                                 user_name: str = None,
@@ -289,7 +1274,7 @@ class SimpleMemoryPlugin(Star):
         if subject_id is None and not delete:
             return "必须提供 subject_id 参数。"
     
-        self.user_roster.update(user_name, subject_id, delete=delete)
+        await asyncio.to_thread(self.user_roster.update, user_name, subject_id, delete=delete)
         return f"已更新 user_name '{user_name}' 与 subject_id '{subject_id}' 的映射关系。"
 
     @filter.llm_tool(name="search_memory_by_user_name") 
@@ -311,9 +1296,9 @@ class SimpleMemoryPlugin(Star):
         if subject_id is None:
             return f"未找到与 user_name '{user_name}' 相关的 subject_id。这是当前的 user_name-subject_id 映射: {self.user_roster.id_dict}。你可以根据这个内容查看是否有实际上是同一人但名字不同的情况。如果有，你必须调用update_user_roster_id_dict来把当前的user_name更新映射列表"
         else:
-            mem_file_path = os.path.join(get_astrbot_data_path(), f"memory_store_{event.unified_msg_origin}.json") if not self.use_global else os.path.join(get_astrbot_data_path(), "memory_store_global.json")
-            state = MemoryStore(mem_file_path).load()
-            mem_info = self.process_mem_info(state, id_list=[subject_id])
+            mem_file_path = self._mem_file_path(event.unified_msg_origin)
+            mem_info, memory_ids = await self._render_memories(mem_file_path, [subject_id])
+            await self._record_access((mem_file_path, (subject_id,), True), memory_ids)
             return mem_info
 
     @filter.llm_tool(name="check_user_roster_id_dict")
@@ -410,7 +1395,7 @@ class SimpleMemoryPlugin(Star):
             }
 
         mem_to_update = json.dumps(operations, ensure_ascii=False)
-        report = self._handle_apply(event, mem_to_update)
+        report = await self._handle_apply(event, mem_to_update)
         logger.info("State update report: %s", report)
         if report.startswith("Update Failed"):
             # await event.send(event.plain_result(report))
@@ -455,7 +1440,7 @@ class SimpleMemoryPlugin(Star):
                     }
                 }
             mem_to_update = json.dumps(operations, ensure_ascii=False)
-            reports.append(self._handle_apply(event, mem_to_update))
+            reports.append(await self._handle_apply(event, mem_to_update))
         
         report = "\n".join(reports)
 
@@ -467,7 +1452,7 @@ class SimpleMemoryPlugin(Star):
         raw_message = (event.message_str or "").strip()
         subcommand, payload = self._parse_arguments(raw_message)
             
-        result = self._handle_apply(event, payload)
+        result = await self._handle_apply(event, payload)
         yield event.plain_result(result)
         return
 
@@ -495,12 +1480,18 @@ class SimpleMemoryPlugin(Star):
         return (
             "记忆指令使用方式:\n"
             "1. /mem gen 生成给大模型使用的长中短期记忆。使用--full参数可使用全部对话历史。\n"
-            "2. /mem check  应用大模型返回的记忆更新结果。\n"
+            "2. /mem check [时间]  查看上次记忆更新结果，附加时间则列出该时间之后变化的记忆。\n"
+            "3. /mem diff [起始版本] [结束版本] 查看记忆版本差异，/mem rollback <版本> 回滚到指定版本（管理员）。\n"
+            "4. /mem export [tier=..] [subject=..] [since=..] 导出记忆为 JSONL，/mem import <文件> 从 JSONL 导入记忆（管理员）。\n"
+            "5. /mem stats [N] 查看访问最多的 N 个 subject 和记忆。\n"
+            "6. /mem gen-all 批量刷新所有会话的记忆（管理员），使用--restart参数可清空进度重新开始。\n"
             "建议流程: /mem gen -> 让大模型总结并应用记忆 -> /mem check 查看结果。"
         )
 
     async def send_prompt(self, event, extra_prompt="", full=False):
-        uid = event.unified_msg_origin
+        return await self._send_prompt_for_uid(event.unified_msg_origin, extra_prompt=extra_prompt, full=full)
+
+    async def _send_prompt_for_uid(self, uid: str, extra_prompt="", full=False, state: Optional[Dict[str, Any]] = None):
         # provider_id = await self.context.get_current_chat_provider_id(uid)
         # logger.info(f"uid:{uid}")
 
@@ -517,7 +1508,12 @@ class SimpleMemoryPlugin(Star):
             person_prompt = self.context.provider_manager.selected_default_persona["prompt"]
         # logger.info(f"人设提示词:{person_prompt}")
 
-        mem_prompt = self._handle_prompt(event, history, full)
+        if state is None:
+            mem_file_path = self._mem_file_path(uid)
+            # 首次生成时记忆文件尚不存在，读取前先确定是否使用全部对话历史
+            full = full or not Path(mem_file_path).exists()
+            state = await asyncio.to_thread(MemoryStore(mem_file_path).load)
+        mem_prompt = self._handle_prompt(uid, history, full, state)
         if extra_prompt != "":
             mem_prompt = extra_prompt + "\n" + mem_prompt
 
@@ -541,18 +1537,19 @@ class SimpleMemoryPlugin(Star):
         # )
         return llm_resp.completion_text
 
-    def _handle_prompt(self, event: AstrMessageEvent, history: str, full=False) -> str:
+    def _handle_prompt(self, uid: str, history: str, full=False, state: Optional[Dict[str, Any]] = None) -> str:
+        """state 为记忆快照，默认读取 uid 对应的记忆文件（会等待文件锁，异步调用方应先在线程中读取后传入）。"""
         conversation = history
         # if not conversation:
         #     return "请在 prompt 子命令后附带对话文本，例如 /memory prompt 最近的对话内容。"
 
-        uid = event.unified_msg_origin
-        mem_file_path = os.path.join(get_astrbot_data_path(), f"memory_store_{uid}.json") if not self.use_global else os.path.join(get_astrbot_data_path(), "memory_store_global.json")
+        mem_file_path = self._mem_file_path(uid)
         if not Path(mem_file_path).exists() or full:
             task_prompt = "please refresh core/long-term/medium-term memory based on the entire conversation.\n"
         else:
             task_prompt = "please refresh core/long-term/medium-term memory based on the latest conversation.\n"
-        state = MemoryStore(mem_file_path).load()
+        if state is None:
+            state = MemoryStore(mem_file_path).load()
         state.pop("metadata", None)
         logger.info("创建记忆提示词，操作者: %s", uid)
         
@@ -612,7 +1609,12 @@ class SimpleMemoryPlugin(Star):
         logger.info(f"记忆提示词内容:{template}")
         return template
 
-    def _handle_apply(self, event, payload_text: str) -> str:
+    async def _handle_apply(self, event, payload_text: str) -> str:
+        # 写入需要持有跨进程文件锁，放到线程中执行以免阻塞事件循环
+        return await asyncio.to_thread(self._apply_for_uid, event.unified_msg_origin, payload_text)
+
+    def _apply_for_uid(self, uid: str, payload_text: str, rebuild: bool = False) -> str:
+        """应用模型返回的记忆更新；rebuild 为 True 时以空记忆为基础，整体替换当前记忆。"""
         payload_text = payload_text.strip()
         if not payload_text:
             return "请提供大模型返回的 JSON 内容。"
@@ -631,14 +1633,20 @@ class SimpleMemoryPlugin(Star):
                 operations = json.loads(json_text.strip())
             except json.JSONDecodeError as exc:
                 return f"JSON parsing failed: {exc}"
-
-        uid = event.unified_msg_origin
-        mem_file_path = os.path.join(get_astrbot_data_path(), f"memory_store_{uid}.json") if not self.use_global else os.path.join(get_astrbot_data_path(), "memory_store_global.json")
-        store = MemoryStore(mem_file_path)
-        state = store.load()
-
-        report = self._apply_operations(state, operations)
-        store.save(state)
+        if not isinstance(operations, dict):
+            return "JSON 内容必须是包含 core_memory/long_term/medium_term 的对象。"
+
+        store = MemoryStore(self._mem_file_path(uid))
+        with store.lock():
+            before = store.load()
+            state = _default_state() if rebuild else _copy_state(before)
+            report = self._apply_operations(state, operations)
+            store.save(state)
+            version = self._history(store.path).record(before, state)
+        if version is not None:
+            report += f"\n- 版本: {version}"
+            if rebuild:
+                report += f"\n重构前的记忆为版本 {version - 1}，可使用 /mem rollback {version - 1} 恢复（管理员）。"
         return report
 
     def _extract_json_block(self, text: str) -> Optional[str]:
@@ -667,19 +1675,21 @@ class SimpleMemoryPlugin(Star):
                 continue
         return None
 
-    def _apply_operations(self, state: Dict[str, Any], operations: Dict[str, Any]) -> str:
+    @classmethod
+    def _apply_operations(cls, state: Dict[str, Any], operations: Dict[str, Any], keep_timestamps: bool = False) -> str:
+        """keep_timestamps 为 True 时保留条目自带的 updated_at（用于导入），否则一律记为当前时间。"""
         now = _utc_now()
         report_lines: List[str] = []
 
         
-        core_result = self._upsert_and_delete(
-            state.setdefault("core_memory", []), operations.get("core_memory", {}), True, now
+        core_result = cls._upsert_and_delete(
+            state.setdefault("core_memory", []), operations.get("core_memory", {}), True, now, keep_timestamps
         )
-        lt_result = self._upsert_and_delete(
-            state.setdefault("long_term", []), operations.get("long_term", {}), True, now
+        lt_result = cls._upsert_and_delete(
+            state.setdefault("long_term", []), operations.get("long_term", {}), True, now, keep_timestamps
         )
-        mt_result = self._upsert_and_delete(
-            state.setdefault("medium_term", []), operations.get("medium_term", {}), True, now
+        mt_result = cls._upsert_and_delete(
+            state.setdefault("medium_term", []), operations.get("medium_term", {}), True, now, keep_timestamps
         )
 
         summary_block = operations.get("summary")
@@ -688,9 +1698,9 @@ class SimpleMemoryPlugin(Star):
 
         # state.setdefault("metadata", {})["last_update"] = now
         state.pop("metadata", None)
-        report_lines.append(self._format_report_line("核心记忆", core_result))
-        report_lines.append(self._format_report_line("长期", lt_result))
-        report_lines.append(self._format_report_line("中期", mt_result))
+        report_lines.append(cls._format_report_line("核心记忆", core_result))
+        report_lines.append(cls._format_report_line("长期", lt_result))
+        report_lines.append(cls._format_report_line("中期", mt_result))
 
         if isinstance(summary_block, dict) and summary_block:
             core_high = summary_block.get("core_memory_highlights", "无")
@@ -702,16 +1712,32 @@ class SimpleMemoryPlugin(Star):
 
         return "记忆已更新:\n" + "\n".join(report_lines)
 
+    @classmethod
     def _upsert_and_delete(
-        self,
+        cls,
         bucket: List[Dict[str, Any]],
         operations: Dict[str, Any],
         is_long_term: bool,
         timestamp: str,
+        keep_timestamps: bool = False,
     ) -> UpsertResult:
-        result = UpsertResult()
         index = {item.get("memory_id"): item for item in bucket if item.get("memory_id")}
+        result = cls._upsert_into_index(index, operations, is_long_term, timestamp, keep_timestamps)
+        bucket.clear()
+        bucket.extend(index.values())
+        return result
 
+    @classmethod
+    def _upsert_into_index(
+        cls,
+        index: Dict[str, Dict[str, Any]],
+        operations: Dict[str, Any],
+        is_long_term: bool,
+        timestamp: str,
+        keep_timestamps: bool = False,
+    ) -> UpsertResult:
+        """在 memory_id -> 条目 的索引上执行 upsert/delete，批量导入时可复用同一个索引。"""
+        result = UpsertResult()
         upserts = operations.get("upsert") or []
         if not isinstance(upserts, list):
             upserts = []
@@ -719,8 +1745,8 @@ class SimpleMemoryPlugin(Star):
         for raw_entry in upserts:
             if not isinstance(raw_entry, dict):
                 continue
-            content = (raw_entry.get("content") or "").strip()
-            subject_id = (raw_entry.get("subject_id") or "global").strip()
+            content = _as_text(raw_entry.get("content")) or ""
+            subject_id = _as_text(raw_entry.get("subject_id")) or "global"
             if not content:
                 continue
             
@@ -728,11 +1754,17 @@ class SimpleMemoryPlugin(Star):
             entry = raw_entry.copy()
             entry["content"] = content
             entry["subject_id"] = subject_id
-            entry["updated_at"] = timestamp
+            # 导入的 updated_at 必须能被解析，否则 changed_since 与按时间导出都会漏掉该条目
+            if not (
+                keep_timestamps
+                and isinstance(entry.get("updated_at"), str)
+                and _parse_timestamp(entry["updated_at"]) is not None
+            ):
+                entry["updated_at"] = timestamp
             entry.setdefault("category", "fact" if is_long_term else "task")
             entry.setdefault("importance", 3)
 
-            entry_id = entry.get("memory_id") or self._generate_entry_id(is_long_term)
+            entry_id = entry.get("memory_id") or cls._generate_entry_id(is_long_term)
             entry["memory_id"] = entry_id
 
             if entry_id in index:#如果已经存在，更新内容并保留原有的 created_at
@@ -752,9 +1784,6 @@ class SimpleMemoryPlugin(Star):
             if entry_id in index and entry_id:
                 del index[entry_id]
                 result.deleted += 1
-
-        bucket.clear()
-        bucket.extend(index.values())
         return result
 
     async def get_all_conversation(self, event: AstrMessageEvent) -> str:
@@ -764,12 +1793,136 @@ class SimpleMemoryPlugin(Star):
         conversation = await conv_mgr.get_conversation(uid, curr_cid)  # Conversation
         return conversation.history
 
-    def _generate_entry_id(self, is_long_term: bool) -> str:
+    @staticmethod
+    def _generate_entry_id(is_long_term: bool) -> str:
         prefix = "lt" if is_long_term else "st"
-        return f"{prefix}-{int(datetime.now(timezone.utc).timestamp())}"
+        return f"{prefix}-{_new_ulid()}"
 
-    def _format_report_line(self, label: str, result: UpsertResult) -> str:
+    @staticmethod
+    def _format_report_line(label: str, result: UpsertResult) -> str:
         return f"- {label}: 新增 {result.added} 条，更新 {result.updated} 条，删除 {result.deleted} 条"
 
     async def terminate(self):
-        """插件销毁时无需特殊处理。"""
+        """插件销毁时写入尚未保存的访问统计。"""
+        await asyncio.to_thread(self.access_stats.flush, self.access_stats.take_pending())
+
+
+def export_memories_jsonl(
+    store_path,
+    out_path,
+    tiers: Optional[List[str]] = None,
+    subject_ids: Optional[List[str]] = None,
+    updated_since: Optional[str] = None,
+) -> int:
+    """将记忆文件流式导出为 JSONL，每行一条记忆并附带 tier 字段，返回导出条数。"""
+    since = _parse_timestamp(updated_since) if updated_since else None
+    if updated_since and since is None:
+        raise ValueError(f"无法解析时间: {updated_since}")
+    count = 0
+    with open(out_path, "w", encoding="utf-8") as out:
+        if not Path(store_path).exists():
+            return count
+        for tier, entry in _iter_store_entries(store_path):
+            if tiers and tier not in tiers:
+                continue
+            if subject_ids and entry.get("subject_id") not in subject_ids:
+                continue
+            if since is not None:
+                updated_at = _parse_timestamp(entry.get("updated_at") or "")
+                if updated_at is None or updated_at < since:
+                    continue
+            out.write(json.dumps({"tier": tier, **entry}, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def import_memories_jsonl(
+    store_path, in_path, batch_size: int = 200, checkpoint_interval: int = 20, keep_checkpoints: int = 10
+) -> str:
+    """逐行读取 JSONL 并按批次以 upsert 方式写入记忆文件，整个导入记录为一个历史版本。
+
+    每个层级的 memory_id 索引只在开始时构建一次，各批次直接写入索引，导入结束后再写回记忆列表。
+    """
+    store = MemoryStore(store_path)
+    with store.lock():
+        before = store.load()
+        state = _copy_state(before)
+        state.pop("metadata", None)
+        indexes = {
+            tier: {item.get("memory_id"): item for item in state.get(tier, []) if item.get("memory_id")}
+            for tier in MEMORY_TIERS
+        }
+        now = _utc_now()
+        imported = skipped = 0
+        batch: Dict[str, List[Dict[str, Any]]] = {}
+        batch_len = 0
+
+        def flush() -> None:
+            for tier, entries in batch.items():
+                SimpleMemoryPlugin._upsert_into_index(indexes[tier], {"upsert": entries}, True, now, keep_timestamps=True)
+            batch.clear()
+
+        with open(in_path, encoding="utf-8") as fp:
+            for line in fp:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    skipped += 1
+                    continue
+                tier = entry.pop("tier", None) if isinstance(entry, dict) else None
+                if tier not in MEMORY_TIERS or not _as_text(entry.get("content")):
+                    skipped += 1
+                    continue
+                # subject_id 与 memory_id 可以是数字，其余类型视为无效行
+                if any(entry.get(field) is not None and _as_text(entry[field]) is None for field in ("subject_id", "memory_id")):
+                    skipped += 1
+                    continue
+                if entry.get("memory_id") is not None:
+                    entry["memory_id"] = _as_text(entry["memory_id"])
+                batch.setdefault(tier, []).append(entry)
+                batch_len += 1
+                imported += 1
+                if batch_len >= batch_size:
+                    flush()
+                    batch_len = 0
+        flush()
+
+        for tier, index in indexes.items():
+            state[tier] = list(index.values())
+        store.save(state)
+        version = MemoryHistory(store_path, checkpoint_interval, keep_checkpoints).record(before, state)
+    report = f"已导入 {imported} 条记忆，跳过 {skipped} 行。"
+    if version is not None:
+        report += f"当前版本为 {version}。"
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """命令行入口: python main.py export|import ..."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="simple_memory 记忆 JSONL 导入导出")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_parser = sub.add_parser("export", help="将记忆文件导出为 JSONL")
+    export_parser.add_argument("store", help="记忆文件路径，例如 memory_store_global.json")
+    export_parser.add_argument("output", help="导出的 JSONL 文件路径")
+    export_parser.add_argument("--tier", action="append", choices=MEMORY_TIERS, help="只导出指定层级，可重复")
+    export_parser.add_argument("--subject", action="append", help="只导出指定 subject_id，可重复")
+    export_parser.add_argument("--since", help="只导出在该时间之后更新的记忆 (ISO 格式)")
+    import_parser = sub.add_parser("import", help="将 JSONL 导入记忆文件")
+    import_parser.add_argument("store", help="记忆文件路径")
+    import_parser.add_argument("input", help="要导入的 JSONL 文件路径")
+    import_parser.add_argument("--batch-size", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        count = export_memories_jsonl(args.store, args.output, args.tier, args.subject, args.since)
+        print(f"已导出 {count} 条记忆到 {args.output}")
+    else:
+        print(import_memories_jsonl(args.store, args.input, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()